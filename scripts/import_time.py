@@ -0,0 +1,26 @@
+"""Measure the cold import time of a module in fresh interpreter processes.
+
+Usage: python scripts/import_time.py [module] [runs]
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+CODE = 'import time; t = time.time(); import {}; print(time.time() - t)'
+
+
+def measure(module, runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', CODE.format(module)], cwd=ROOT)
+        timings.append(float(output.strip()))
+    return sorted(timings)
+
+
+if __name__ == '__main__':
+    module = sys.argv[1] if len(sys.argv) > 1 else 'webpy_graphql.graphqlview'
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    timings = measure(module, runs)
+    print('{}: min {:.1f} ms, median {:.1f} ms, max {:.1f} ms over {} runs'.format(
+        module, timings[0] * 1000, timings[len(timings) // 2] * 1000, timings[-1] * 1000, runs))
@@ -0,0 +1,309 @@
+"""Load-test GraphQLView against a local stub backend.
+
+Starts a create_app-style web.py application on a local port and drives it at
+a target request rate, then reports throughput, latency percentiles and error
+rates per scenario. Resolvers sleep and burn CPU on request to simulate
+backends. Exits non-zero when a --max-* threshold is exceeded, for CI gating.
+
+Usage:
+    python scripts/loadtest.py --rps 200 --duration 10 --concurrency 16
+    python scripts/loadtest.py --scenarios scenarios.json --max-p99-ms 50
+
+A scenarios file is a JSON list of objects keyed by the option names below
+(with underscores for dashes); "queries" maps query names to weights, e.g.
+{"name": "mixed", "rps": 100, "queries": {"simple": 3, "payload": 1}}.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from six.moves import http_client, queue
+from six.moves.socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from graphql.type.definition import GraphQLArgument, GraphQLField, GraphQLList, GraphQLObjectType
+from graphql.type.scalars import GraphQLInt, GraphQLString
+from graphql.type.schema import GraphQLSchema
+
+from webpy_graphql import GraphQLView
+
+
+def simulate_backend(latency_ms=0, cpu_ms=0):
+    if cpu_ms:
+        deadline = time.time() + cpu_ms / 1000.0
+        while time.time() < deadline:
+            pass
+    if latency_ms:
+        time.sleep(latency_ms / 1000.0)
+
+
+def resolve_item(root, info, latency_ms=0, cpu_ms=0):
+    simulate_backend(latency_ms, cpu_ms)
+    return 'item'
+
+
+def resolve_payload(root, info, size=0, latency_ms=0, cpu_ms=0):
+    simulate_backend(latency_ms, cpu_ms)
+    return 'x' * size
+
+
+def resolve_items(root, info, count=0, latency_ms=0, cpu_ms=0):
+    simulate_backend(latency_ms, cpu_ms)
+    return ['item {}'.format(index) for index in range(count)]
+
+
+BACKEND_ARGS = {
+    'latency_ms': GraphQLArgument(GraphQLInt),
+    'cpu_ms': GraphQLArgument(GraphQLInt),
+}
+
+Schema = GraphQLSchema(GraphQLObjectType(
+    name='LoadTestQuery',
+    fields={
+        'item': GraphQLField(GraphQLString, args=BACKEND_ARGS, resolver=resolve_item),
+        'payload': GraphQLField(
+            GraphQLString,
+            args=dict(BACKEND_ARGS, size=GraphQLArgument(GraphQLInt)),
+            resolver=resolve_payload),
+        'items': GraphQLField(
+            GraphQLList(GraphQLString),
+            args=dict(BACKEND_ARGS, count=GraphQLArgument(GraphQLInt)),
+            resolver=resolve_items),
+    }
+))
+
+QUERIES = {
+    'simple': '{{ item(latency_ms: {latency_ms}, cpu_ms: {cpu_ms}) }}',
+    'payload': '{{ payload(size: {payload_size}, latency_ms: {latency_ms}, cpu_ms: {cpu_ms}) }}',
+    'list': '{{ items(count: {list_size}, latency_ms: {latency_ms}, cpu_ms: {cpu_ms}) }}',
+    'fanout': '{{ a: item(latency_ms: {latency_ms}, cpu_ms: {cpu_ms}) '
+              'b: item(latency_ms: {latency_ms}, cpu_ms: {cpu_ms}) '
+              'c: item(latency_ms: {latency_ms}, cpu_ms: {cpu_ms}) }}',
+}
+
+
+class index(GraphQLView):
+    class GraphQLMeta:
+        schema = Schema
+
+
+class batch(GraphQLView):
+    class GraphQLMeta:
+        schema = Schema
+        batch = True
+
+
+def create_app(**kwargs):
+    for key, value in kwargs.items():
+        setattr(index.GraphQLMeta, key, value)
+        setattr(batch.GraphQLMeta, key, value)
+    urls = ('/graphql', 'index',
+            '/graphql/batch', 'batch')
+    return web.application(urls, globals())
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_server(app):
+    server = make_server('127.0.0.1', 0, app.wsgifunc(),
+                         server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def build_body(scenario, rng):
+    names = sorted(scenario['queries'])
+    weights = [scenario['queries'][name] for name in names]
+
+    def pick():
+        point = rng.uniform(0, sum(weights))
+        for name, weight in zip(names, weights):
+            point -= weight
+            if point <= 0:
+                return name
+        return names[-1]
+
+    operations = [{'query': QUERIES[pick()].format(**scenario)} for _ in range(scenario['batch_size'])]
+    if scenario['batch_size'] == 1:
+        return '/graphql', json.dumps(operations[0])
+    return '/graphql/batch', json.dumps(operations)
+
+
+def send(port, path, body):
+    connection = http_client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('POST', path, body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        payload = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        return 'HTTP {}'.format(response.status)
+    results = json.loads(payload.decode('utf8'))
+    if not isinstance(results, list):
+        results = [results]
+    for result in results:
+        if 'errors' in result.get('payload', result):
+            return 'GraphQL error'
+    return None
+
+
+def run_scenario(port, scenario):
+    rng = random.Random(scenario['seed'])
+    schedule = queue.Queue()
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = schedule.get()
+            if item is None:
+                return
+            scheduled, path, body = item
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                error = send(port, path, body)
+            except Exception as e:
+                error = type(e).__name__
+            # Latency is measured from the scheduled start so a backed-up client doesn't hide queueing.
+            with lock:
+                samples.append((time.time() - scheduled, error))
+
+    workers = [threading.Thread(target=worker) for _ in range(scenario['concurrency'])]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+
+    start = time.time() + 0.05
+    total = int(scenario['rps'] * scenario['duration'])
+    for number in range(total):
+        path, body = build_body(scenario, rng)
+        schedule.put((start + number / float(scenario['rps']), path, body))
+    for _ in workers:
+        schedule.put(None)
+    for thread in workers:
+        thread.join()
+
+    return summarize(scenario, samples, time.time() - start)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarize(scenario, samples, elapsed):
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    errors = {}
+    for _, error in samples:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        'name': scenario['name'],
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p90_ms': round(percentile(latencies, 0.9), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2) if latencies else 0,
+        'error_rate': round(sum(errors.values()) / float(len(samples)), 4) if samples else 0,
+        'errors': errors,
+    }
+
+
+def check_thresholds(report, options):
+    failures = []
+    if options.max_p99_ms is not None and report['p99_ms'] > options.max_p99_ms:
+        failures.append('{}: p99 {} ms > {} ms'.format(report['name'], report['p99_ms'], options.max_p99_ms))
+    if options.max_error_rate is not None and report['error_rate'] > options.max_error_rate:
+        failures.append('{}: error rate {} > {}'.format(report['name'], report['error_rate'], options.max_error_rate))
+    if options.min_throughput is not None and report['throughput_rps'] < options.min_throughput:
+        failures.append('{}: throughput {} rps < {} rps'.format(
+            report['name'], report['throughput_rps'], options.min_throughput))
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test GraphQLView against a local stub backend.')
+    parser.add_argument('--scenarios', help='JSON file with a list of scenarios; options below are their defaults')
+    parser.add_argument('--name', default='default')
+    parser.add_argument('--rps', type=float, default=50, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--queries', type=json.loads, default={'simple': 1},
+                        help='JSON mapping of query name ({}) to weight'.format(', '.join(sorted(QUERIES))))
+    parser.add_argument('--batch-size', type=int, default=1, help='operations per request')
+    parser.add_argument('--payload-size', type=int, default=1024, help='bytes returned by the payload query')
+    parser.add_argument('--list-size', type=int, default=100, help='items returned by the list query')
+    parser.add_argument('--latency-ms', type=int, default=0, help='simulated backend latency per resolver')
+    parser.add_argument('--cpu-ms', type=int, default=0, help='simulated CPU cost per resolver')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-p99-ms', type=float)
+    parser.add_argument('--max-error-rate', type=float)
+    parser.add_argument('--min-throughput', type=float)
+    parser.add_argument('--json', action='store_true', help='print reports as JSON')
+    return parser.parse_args(argv)
+
+
+def load_scenarios(options):
+    defaults = dict((key, value) for key, value in vars(options).items()
+                    if key not in ('scenarios', 'max_p99_ms', 'max_error_rate', 'min_throughput', 'json'))
+    if not options.scenarios:
+        return [defaults]
+    with open(options.scenarios) as f:
+        return [dict(defaults, **scenario) for scenario in json.load(f)]
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    scenarios = load_scenarios(options)
+    for scenario in scenarios:
+        unknown = set(scenario['queries']) - set(QUERIES)
+        if unknown:
+            raise SystemExit('Unknown queries: {}'.format(', '.join(sorted(unknown))))
+
+    server = start_server(create_app())
+    try:
+        reports = [run_scenario(server.server_port, scenario) for scenario in scenarios]
+    finally:
+        server.shutdown()
+
+    if options.json:
+        print(json.dumps(reports, indent=2, sort_keys=True))
+    else:
+        row = '{:<20} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8}'
+        print(row.format('scenario', 'requests', 'rps', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'errors'))
+        for report in reports:
+            print(row.format(report['name'], report['requests'], report['throughput_rps'], report['p50_ms'],
+                             report['p90_ms'], report['p99_ms'], report['max_ms'],
+                             '{:.2%}'.format(report['error_rate'])))
+
+    failures = [failure for report in reports for failure in check_thresholds(report, options)]
+    for failure in failures:
+        sys.stderr.write(failure + '\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
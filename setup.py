@@ -2,7 +2,6 @@ from setuptools import setup, find_packages
 
 required_packages = [
     'web.py',
-    'werkzeug',
     'graphql-server-core>=1.0.dev',
     'graphql-core>=1.0',
     'six',
@@ -2,7 +2,7 @@ import web
 import os
 import sys
 
-from webpy_graphql import GraphQLView
+from webpy_graphql import GraphQLView, MetricsView
 from schema import Schema
 
 
@@ -10,10 +10,15 @@ class index(GraphQLView):
     class GraphQLMeta:
         schema=Schema
 
+
+class metrics(MetricsView):
+    pass
+
 def create_app(**kwargs):
     for key, value in kwargs.iteritems():
         setattr(index.GraphQLMeta, key, value)
-    urls = ('/graphql', 'index')
+    urls = ('/graphql', 'index',
+            '/metrics', 'metrics')
     return web.application(urls, globals())
 
 
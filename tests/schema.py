@@ -1,12 +1,38 @@
-from graphql.type.definition import GraphQLArgument, GraphQLField, GraphQLNonNull, GraphQLObjectType
+import threading
+
+from graphql.type.definition import GraphQLArgument, GraphQLField, GraphQLList, GraphQLNonNull, GraphQLObjectType
 from graphql.type.scalars import GraphQLString, GraphQLInt
 from graphql.type.schema import GraphQLSchema
 
+from webpy_graphql import GraphQLRawJSON, cache_hint
+
 
 def resolve_raises(*_):
     raise Exception("Throws!")
 
 
+resolver_calls = {'cached': 0, 'blocking': 0}
+blocking_events = {'entered': threading.Event(), 'release': threading.Event()}
+
+
+def resolve_blocking(self, info):
+    resolver_calls['blocking'] += 1
+    blocking_events['entered'].set()
+    blocking_events['release'].wait(5)
+    return 'Unblocked'
+
+
+@cache_hint(max_age=60)
+def resolve_cached(self, info, name="World"):
+    resolver_calls['cached'] += 1
+    return 'Hello {}'.format(name)
+
+
+@cache_hint(max_age=30, scope='private')
+def resolve_cached_private(self, info):
+    return 'Hello {}'.format(getattr(info.context, 'env', {}).get('HTTP_X_USER', 'Private'))
+
+
 QueryRootType = GraphQLObjectType(
     name='QueryRoot',
     fields={
@@ -28,6 +54,29 @@ QueryRootType = GraphQLObjectType(
             type=GraphQLString,
             args={'name': GraphQLArgument(GraphQLString),},
             resolver=lambda self, info, name="World": 'Hello {}'.format(name)
+        ),
+        'cached': GraphQLField(
+            type=GraphQLString,
+            args={'name': GraphQLArgument(GraphQLString)},
+            resolver=resolve_cached
+        ),
+        'cached_private': GraphQLField(
+            type=GraphQLString,
+            resolver=resolve_cached_private
+        ),
+        'blocking': GraphQLField(
+            type=GraphQLString,
+            resolver=resolve_blocking
+        ),
+        'raw_json': GraphQLField(
+            type=GraphQLRawJSON,
+            args={'value': GraphQLArgument(GraphQLString)},
+            resolver=lambda self, info, value='{"nested": [1, 2, {"a": "b"}]}': value
+        ),
+        'raw_json_list': GraphQLField(
+            type=GraphQLList(GraphQLRawJSON),
+            args={'values': GraphQLArgument(GraphQLList(GraphQLString))},
+            resolver=lambda self, info, values=(): values
         )
     }
 )
@@ -1,16 +1,32 @@
 import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 import web
 import unittest
 from functools import wraps
 
 from paste.fixture import TestApp
-from app import create_app
+from app import create_app, index
+from schema import blocking_events, resolver_calls
+from webpy_graphql import GraphQLMetrics, MemoryTTLStore, RawJSON, Registry, SingleFlight
+from webpy_graphql.rawjson import RawJSONEncoder
 
 try:
     from urllib import urlencode
 except ImportError:
     from urllib.parse import urlencode
 
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    assert condition(), 'Timed out waiting for condition'
+
+
 j = lambda **kwargs: json.dumps(kwargs)
 jl = lambda **kwargs: json.dumps([kwargs])
 
@@ -37,7 +53,17 @@ class WebPyGraphqlTests(unittest.TestCase):
         create_app(batch=None,
                    graphiql=False,
                    graphiql_temp_title=None,
-                   context=None)
+                   context=None,
+                   slow_query_threshold=None,
+                   slow_query_logger=None,
+                   profile_sample_rate=None,
+                   profile_dir=None,
+                   metrics=None,
+                   validate_raw_json=False,
+                   pretty=False,
+                   cache_store=None,
+                   cache_hints=None,
+                   single_flight=None)
 
     def test_main_page(self):
         r = self.testApp.get('/graphql', params={'query': '{test}'})
@@ -397,6 +423,441 @@ class WebPyGraphqlTests(unittest.TestCase):
         self.assertEqual(r.status, 200)
         self.assertIn("<title>TestTitle</title>", r.body)
 
+    def test_slow_query_log(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log = logging.getLogger('tests.slow_query')
+        log.addHandler(handler)
+        create_app(slow_query_threshold=0, slow_query_logger=log)
+
+        r = self.testApp.get('/graphql',
+                             params={'query': 'query helloWorld($password: String){ test_args(name: $password) }',
+                                     'operationName': 'helloWorld',
+                                     'variables': json.dumps({'password': 'hunter2'})})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(len(records), 1)
+        entry = json.loads(records[0].args[0])
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['graphql_status'], 200)
+        self.assertEqual(entry['result_size'], len(r.body))
+        self.assertEqual(entry['operations'][0]['operation_name'], 'helloWorld')
+        self.assertEqual(entry['operations'][0]['variables'], {'password': '[REDACTED]'})
+        self.assertEqual(len(entry['operations'][0]['query_hash']), 64)
+        self.assertEqual(set(entry['phases_ms']), {'parse_body', 'parse', 'validate', 'execute', 'encode'})
+
+    @_set_params(batch=True)
+    def test_slow_query_log_unhandled_error(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log = logging.getLogger('tests.failed_query')
+        log.addHandler(handler)
+        create_app(slow_query_threshold=0, slow_query_logger=log)
+
+        r = self.testApp.post('/graphql', params='[1]',
+                              headers={'Content-Type': 'application/json'},
+                              expect_errors=True)
+        self.assertEqual(r.status, 500)
+        self.assertEqual(len(records), 1)
+        entry = json.loads(records[0].args[0])
+        self.assertEqual(entry['status'], 500)
+        self.assertEqual(entry['error_type'], 'AttributeError')
+
+    def test_slow_query_log_below_threshold(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log = logging.getLogger('tests.fast_query')
+        log.addHandler(handler)
+        create_app(slow_query_threshold=60, slow_query_logger=log)
+
+        r = self.testApp.get('/graphql', params={'query': '{test}'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(records, [])
+
+    def test_sampled_profile(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        create_app(profile_sample_rate=1, profile_dir=profile_dir)
+
+        r = self.testApp.get('/graphql', params={'query': '{test}'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"test":"Hello World"}}')
+        self.assertEqual(len(os.listdir(profile_dir)), 1)
+
+    def test_sampled_profile_unwritable_dir(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log = logging.getLogger('webpy_graphql.profile')
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        blocker = tempfile.NamedTemporaryFile()
+        self.addCleanup(blocker.close)
+        create_app(profile_sample_rate=1, profile_dir=os.path.join(blocker.name, 'profiles'))
+
+        r = self.testApp.get('/graphql', params={'query': '{test}'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"test":"Hello World"}}')
+        self.assertEqual(len(records), 1)
+        self.assertIsNotNone(records[0].exc_info)
+
+    def test_metrics_endpoint(self):
+        create_app(metrics=GraphQLMetrics())
+
+        self.testApp.get('/graphql', params={'query': 'query metricsHello { test }',
+                                             'operationName': 'metricsHello'})
+        self.testApp.get('/graphql', params={'query': 'query metricsThrower { thrower }',
+                                             'operationName': 'metricsThrower'})
+        r = self.testApp.get('/metrics')
+        self.assertEqual(r.status, 200)
+        self.assertIn('graphql_requests_total{operation="metricsHello",status="200",error_type="none"} 1.0', r.body)
+        self.assertIn('graphql_requests_total{operation="metricsThrower",status="200",error_type="Exception"} 1.0', r.body)
+        self.assertIn('# TYPE graphql_request_duration_seconds histogram', r.body)
+        self.assertIn('graphql_request_duration_seconds_bucket{le="+Inf"}', r.body)
+
+    def test_metrics_http_status(self):
+        registry = Registry()
+        create_app(metrics=GraphQLMetrics(registry))
+
+        r = self.testApp.get('/graphql', params={'query': '{ unknownField }'})
+        self.assertEqual(r.status, 200)
+        r = self.testApp.post('/graphql', params='{', headers={'Content-Type': 'application/json'})
+        self.assertEqual(r.status, 200)
+        self.assertIn('graphql_requests_total{operation="anonymous",status="200",error_type="GraphQLError"} 1.0',
+                      registry.render())
+        self.assertIn('graphql_requests_total{operation="anonymous",status="200",error_type="BadRequest"} 1.0',
+                      registry.render())
+
+    @_set_params(batch=True)
+    def test_metrics_batch_size(self):
+        registry = Registry()
+        create_app(metrics=GraphQLMetrics(registry))
+
+        self.testApp.post('/graphql',
+                          params=json.dumps([{'query': '{test}'}, {'query': '{test}'}]),
+                          headers={'Content-Type': 'application/json'})
+        body = registry.render()
+        self.assertIn('graphql_batch_size_bucket{le="1.0"} 0', body)
+        self.assertIn('graphql_batch_size_bucket{le="2.0"} 1', body)
+        self.assertIn('graphql_requests_total{operation="anonymous",status="200",error_type="none"} 2.0', body)
+
+    @_set_params(batch=True)
+    def test_metrics_batch_error_type_per_operation(self):
+        registry = Registry()
+        create_app(metrics=GraphQLMetrics(registry))
+
+        self.testApp.post('/graphql',
+                          params=json.dumps([{'query': 'query A { test }', 'operationName': 'A'},
+                                             {'query': 'query B { thrower }', 'operationName': 'B'}]),
+                          headers={'Content-Type': 'application/json'})
+        body = registry.render()
+        self.assertIn('graphql_requests_total{operation="A",status="200",error_type="none"} 1.0', body)
+        self.assertIn('graphql_requests_total{operation="B",status="200",error_type="Exception"} 1.0', body)
+
+    def test_metrics_multiprocess_aggregation(self):
+        multiprocess_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, multiprocess_dir)
+        registry = Registry(multiprocess_dir=multiprocess_dir)
+        other = Registry()
+        for r in (registry, other):
+            r.counter('hits_total', 'Hits.', ('path',)).inc(path='/graphql')
+            r.histogram('latency_seconds', 'Latency.', buckets=(1,)).observe(0.5)
+        with open(os.path.join(multiprocess_dir, 'metrics-0.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+
+        body = registry.render()
+        self.assertIn('hits_total{path="/graphql"} 2.0', body)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', body)
+        self.assertIn('latency_seconds_sum 1.0', body)
+        self.assertIn('latency_seconds_count 2', body)
+
+    def test_metrics_multiprocess_background_flush(self):
+        multiprocess_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, multiprocess_dir)
+        registry = Registry(multiprocess_dir=multiprocess_dir, flush_interval=0.01)
+        self.addCleanup(registry.close)
+        registry.counter('hits_total', 'Hits.').inc()
+
+        _wait_for(lambda: os.path.exists(registry.path or ''))
+        self.assertTrue(os.path.basename(registry.path).startswith('metrics-{}-'.format(os.getpid())))
+        with open(registry.path) as f:
+            self.assertEqual(json.load(f)['hits_total']['values'], [[[], 1]])
+
+    def test_metrics_multiprocess_forked_child(self):
+        multiprocess_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, multiprocess_dir)
+        registry = Registry(multiprocess_dir=multiprocess_dir, flush_interval=0.01)
+        self.addCleanup(registry.close)
+        hits = registry.counter('hits_total', 'Hits.')
+        hits.inc()
+        registry.flush()
+        parent_path = registry.path
+
+        # Pretend to be a forked worker: it starts from zero and writes its own file.
+        registry.pid = -1
+        hits.inc()
+        registry.flush()
+        self.assertNotEqual(registry.path, parent_path)
+        self.assertIn('hits_total 2.0', registry.render())
+
+    def test_raw_json_passthrough(self):
+        r = self.testApp.get('/graphql', params={'query': '{ raw_json }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"raw_json":{"nested": [1, 2, {"a": "b"}]}}}')
+
+    @_set_params(pretty=True)
+    def test_raw_json_passthrough_pretty(self):
+        r = self.testApp.get('/graphql', params={'query': '{ raw_json }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(json.loads(r.body), {'data': {'raw_json': {'nested': [1, 2, {'a': 'b'}]}}})
+
+    def test_raw_json_mixed_fragment_types(self):
+        encoded = RawJSONEncoder(sort_keys=True, separators=(',', ':')).encode({
+            'bytes': RawJSON(u'"\u00e9"'.encode('utf8')),
+            'text': RawJSON(u'"\u00e8"'),
+        })
+        self.assertEqual(json.loads(encoded), {'bytes': u'\u00e9', 'text': u'\u00e8'})
+
+    @_set_params(validate_raw_json=True)
+    def test_raw_json_invalid_fragment(self):
+        r = self.testApp.get('/graphql',
+                             params={'query': '{ test, raw_json(value: "{invalid") }'})
+        self.assertEqual(r.status, 200)
+        body = json.loads(r.body)
+        self.assertEqual(body['data'], {'test': 'Hello World', 'raw_json': None})
+        self.assertTrue(body['errors'][0]['message'].startswith('Invalid raw JSON fragment'))
+        self.assertEqual(body['errors'][0]['locations'], [{'line': 1, 'column': 9}])
+
+    @_set_params(validate_raw_json=True)
+    def test_raw_json_list_invalid_fragment(self):
+        r = self.testApp.get('/graphql',
+                             params={'query': '{ raw_json_list(values: ["[1]", "{invalid"]) }'})
+        self.assertEqual(r.status, 200)
+        body = json.loads(r.body)
+        self.assertEqual(body['data'], {'raw_json_list': None})
+        self.assertTrue(body['errors'][0]['message'].startswith('Invalid raw JSON fragment'))
+
+    @_set_params(validate_raw_json=True)
+    def test_raw_json_list_with_validation(self):
+        r = self.testApp.get('/graphql', params={'query': '{ raw_json_list(values: ["[1]", "{}"]) }'})
+        self.assertEqual(r.body, '{"data":{"raw_json_list":[[1],{}]}}')
+
+    @_set_params(validate_raw_json=True)
+    def test_raw_json_valid_fragment_with_validation(self):
+        r = self.testApp.get('/graphql', params={'query': '{ raw_json(value: "[1, 2]") }'})
+        self.assertEqual(r.body, '{"data":{"raw_json":[1, 2]}}')
+
+    @_set_params(cache_store=MemoryTTLStore())
+    def test_resolver_cache(self):
+        calls = resolver_calls['cached']
+        for _ in range(2):
+            r = self.testApp.get('/graphql', params={'query': '{ cached(name: "Cache") }'})
+            self.assertEqual(r.status, 200)
+            self.assertEqual(r.body, '{"data":{"cached":"Hello Cache"}}')
+            self.assertEqual(r.header_dict.get('cache-control'), 'max-age=60, public')
+        self.assertEqual(resolver_calls['cached'], calls + 1)
+
+        self.testApp.get('/graphql', params={'query': '{ cached(name: "Other") }'})
+        self.assertEqual(resolver_calls['cached'], calls + 2)
+
+    @_set_params(cache_store=MemoryTTLStore())
+    def test_resolver_cache_min_ttl_and_scope(self):
+        r = self.testApp.get('/graphql', params={'query': '{ cached, cached_private }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.header_dict.get('cache-control'), 'max-age=30, private')
+
+    @_set_params(cache_store=MemoryTTLStore())
+    def test_resolver_cache_unhinted_root_field(self):
+        r = self.testApp.get('/graphql', params={'query': '{ cached, test }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.header_dict.get('cache-control'), None)
+
+    @_set_params(cache_store=MemoryTTLStore())
+    def test_resolver_cache_typename(self):
+        r = self.testApp.get('/graphql', params={'query': '{ cached(name: "Typename") __typename }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"cached":"Hello Typename","__typename":"QueryRoot"}}')
+        self.assertEqual(r.header_dict.get('cache-control'), 'max-age=60, public')
+
+    @_set_params(cache_store=MemoryTTLStore())
+    def test_resolver_cache_introspection(self):
+        r = self.testApp.get('/graphql', params={'query': '{ __schema { queryType { name } } }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(json.loads(r.body), {'data': {'__schema': {'queryType': {'name': 'QueryRoot'}}}})
+
+    @_set_params(cache_store=MemoryTTLStore())
+    def test_resolver_cache_skips_mutations(self):
+        r = self.testApp.post('/graphql',
+                              params=j(query='mutation { writeTest { cached } }'),
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"writeTest":{"cached":"Hello World"}}}')
+        self.assertEqual(r.header_dict.get('cache-control'), None)
+
+    @_set_params(cache_store=MemoryTTLStore(), cache_hints={'QueryRoot.test': (30, 'public')})
+    def test_resolver_cache_hints_option(self):
+        r = self.testApp.get('/graphql', params={'query': '{ test, cached }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"test":"Hello World","cached":"Hello World"}}')
+        self.assertEqual(r.header_dict.get('cache-control'), 'max-age=30, public')
+
+    def test_memory_ttl_store_expires(self):
+        store = MemoryTTLStore()
+        store.set('key', ('value',), 60)
+        self.assertEqual(store.get('key'), ('value',))
+        store.set('key', ('value',), -1)
+        self.assertEqual(store.get('key'), None)
+
+    def set_cache_user_key(self, key):
+        index.GraphQLMeta.get_cache_user_key = lambda: key
+        self.addCleanup(delattr, index.GraphQLMeta, 'get_cache_user_key')
+
+    def start_blocking_requests(self, query):
+        blocking_events['entered'].clear()
+        blocking_events['release'].clear()
+        self.addCleanup(blocking_events['release'].set)
+        calls = resolver_calls['blocking']
+        bodies = []
+
+        def request():
+            bodies.append(self.testApp.get('/graphql', params={'query': query}).body)
+
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        threads[0].start()
+        blocking_events['entered'].wait(5)
+        threads[1].start()
+        return threads, bodies, calls
+
+    @_set_params(single_flight=SingleFlight(), cache_store=MemoryTTLStore())
+    def test_single_flight_query(self):
+        self.set_cache_user_key('user')
+        r = self.testApp.get('/graphql', params={'query': '{ cached(name: "Flight") }'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"cached":"Hello Flight"}}')
+        self.assertEqual(r.header_dict.get('cache-control'), 'max-age=60, public')
+
+    @_set_params(single_flight=SingleFlight())
+    def test_single_flight_skips_mutations(self):
+        r = self.testApp.post('/graphql',
+                              params=j(query='mutation TestMutation { writeTest { test } }'),
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, '{"data":{"writeTest":{"test":"Hello World"}}}')
+
+    @_set_params(single_flight=SingleFlight())
+    def test_single_flight_coalesces_requests(self):
+        self.set_cache_user_key('user')
+        flight = index.GraphQLMeta.single_flight
+        threads, bodies, calls = self.start_blocking_requests('{ blocking }')
+        _wait_for(lambda: flight.flights and list(flight.flights.values())[0].waiters == 1)
+        blocking_events['release'].set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(resolver_calls['blocking'], calls + 1)
+        self.assertEqual(bodies, ['{"data":{"blocking":"Unblocked"}}'] * 2)
+
+    @_set_params(single_flight=SingleFlight())
+    def test_single_flight_requires_cache_user_key(self):
+        threads, bodies, calls = self.start_blocking_requests('{ blocking }')
+        _wait_for(lambda: resolver_calls['blocking'] == calls + 2)
+        blocking_events['release'].set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(bodies, ['{"data":{"blocking":"Unblocked"}}'] * 2)
+
+    @_set_params(single_flight=SingleFlight(), cache_store=MemoryTTLStore())
+    def test_single_flight_never_shares_private_results(self):
+        self.set_cache_user_key('user')
+        flight = index.GraphQLMeta.single_flight
+        threads, bodies, calls = self.start_blocking_requests('{ blocking, cached_private }')
+        _wait_for(lambda: flight.flights and list(flight.flights.values())[0].waiters == 1)
+        blocking_events['release'].set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(resolver_calls['blocking'], calls + 2)
+        self.assertEqual(bodies, ['{"data":{"blocking":"Unblocked","cached_private":"Hello Private"}}'] * 2)
+
+    @_set_params(single_flight=SingleFlight(), cache_store=MemoryTTLStore())
+    def test_single_flight_scope_does_not_leak_private_cache(self):
+        index.GraphQLMeta.get_single_flight_scope = lambda: 'public'
+        self.addCleanup(delattr, index.GraphQLMeta, 'get_single_flight_scope')
+        index.GraphQLMeta.get_cache_user_key = lambda: web.ctx.env.get('HTTP_X_USER')
+        self.addCleanup(delattr, index.GraphQLMeta, 'get_cache_user_key')
+
+        for user in ('alice', 'bob', 'alice'):
+            r = self.testApp.get('/graphql', params={'query': '{ cached_private }'},
+                                 headers={'X-User': user})
+            self.assertEqual(r.body, '{{"data":{{"cached_private":"Hello {}"}}}}'.format(user))
+
+    def test_single_flight_shares_result(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def leader():
+            calls.append('leader')
+            started.set()
+            release.wait()
+            return 'shared'
+
+        def follower():
+            calls.append('follower')
+            return 'own'
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', leader)))]
+        threads[0].start()
+        started.wait()
+        for _ in range(3):
+            threads.append(threading.Thread(target=lambda: results.append(flight.do('key', follower))))
+            threads[-1].start()
+        _wait_for(lambda: flight.flights['key'].waiters == 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, ['leader'])
+        self.assertEqual(results, ['shared'] * 4)
+        self.assertEqual(flight.flights, {})
+
+    def test_single_flight_waiter_limit_and_timeout(self):
+        # A nested call for the same key would wait on its own flight forever without these bounds.
+        flight = SingleFlight(max_waiters=0)
+        self.assertEqual(flight.do('key', lambda: flight.do('key', lambda: 'own')), 'own')
+
+        flight = SingleFlight(timeout=0.01)
+        self.assertEqual(flight.do('key', lambda: flight.do('key', lambda: 'timed out')), 'timed out')
+        self.assertEqual(flight.flights, {})
+
+    def test_single_flight_leader_finishes_after_timeout(self):
+        flight = SingleFlight(timeout=0.01)
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def leader():
+            started.set()
+            release.wait()
+            return 'leader'
+
+        thread = threading.Thread(target=lambda: results.append(flight.do('key', leader)))
+        thread.start()
+        started.wait()
+        self.assertEqual(flight.do('key', lambda: 'own'), 'own')
+        # The timed-out flight is gone, so the next caller leads a new one.
+        self.assertEqual(flight.do('key', lambda: 'next'), 'next')
+        release.set()
+        thread.join()
+
+        self.assertEqual(results, ['leader'])
+        self.assertEqual(flight.flights, {})
+
 
 if __name__ == '__main__':
     unittest.main()
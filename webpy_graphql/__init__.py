@@ -1,3 +1,8 @@
 from .graphqlview import GraphQLView
+from .caching import CacheHint, MemoryTTLStore, cache_hint
+from .metrics import GraphQLMetrics, MetricsView, Registry
+from .rawjson import GraphQLRawJSON, RawJSON
+from .singleflight import SingleFlight
 
-__all__ = ['GraphQLView']
+__all__ = ['GraphQLView', 'CacheHint', 'MemoryTTLStore', 'cache_hint', 'GraphQLMetrics', 'MetricsView', 'Registry',
+           'GraphQLRawJSON', 'RawJSON', 'SingleFlight']
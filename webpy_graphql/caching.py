@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+
+from collections import namedtuple
+
+from promise import Promise
+
+
+PUBLIC = 'public'
+PRIVATE = 'private'
+
+CacheHint = namedtuple('CacheHint', ['max_age', 'scope'])
+
+
+def cache_hint(max_age, scope=PUBLIC):
+    assert scope in (PUBLIC, PRIVATE), 'Cache scope must be either "{}" or "{}".'.format(PUBLIC, PRIVATE)
+
+    def decorator(resolver):
+        resolver.cache_hint = CacheHint(max_age, scope)
+        return resolver
+    return decorator
+
+
+class MemoryTTLStore(object):
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries = dict(
+                    (key, entry) for key, entry in self.entries.items() if entry[0] >= now
+                )
+                if len(self.entries) >= self.max_entries:
+                    self.entries.clear()
+            self.entries[key] = (now + ttl, value)
+
+
+def default_cache_identity(root, info):
+    if info.parent_type is info.schema.get_query_type():
+        return 'ROOT'
+    if isinstance(root, dict):
+        return root.get('id')
+    return getattr(root, 'id', None)
+
+
+class ResolverCacheMiddleware(object):
+    def __init__(self, store, hints=None, user_key=None, identity=default_cache_identity, metrics=None):
+        self.store = store
+        self.hints = dict((name, CacheHint(*hint)) for name, hint in (hints or {}).items())
+        self.user_key = user_key
+        self.identity = identity
+        self.metrics = metrics
+        self.max_age = None
+        self.scope = PUBLIC
+
+    def get_hint(self, info):
+        if info.field_name.startswith('__'):
+            return None
+        hint = self.hints.get('{}.{}'.format(info.parent_type.name, info.field_name))
+        if hint is None:
+            field = info.parent_type.fields.get(info.field_name)
+            hint = getattr(field and field.resolver, 'cache_hint', None)
+        return hint
+
+    def update_policy(self, hint, info):
+        # Meta fields such as __typename aren't part of the schema and never affect the policy.
+        if info.field_name.startswith('__'):
+            return
+        if info.operation.operation != 'query':
+            self.max_age = 0
+            return
+        if hint is None:
+            # Unhinted root fields make the whole response uncacheable; nested ones inherit.
+            if info.parent_type is info.schema.get_query_type():
+                self.max_age = 0
+            return
+        if self.max_age is None or hint.max_age < self.max_age:
+            self.max_age = hint.max_age
+        if hint.scope == PRIVATE:
+            self.scope = PRIVATE
+
+    def get_cache_control(self):
+        if not self.max_age:
+            return None
+        return 'max-age={}, {}'.format(self.max_age, self.scope)
+
+    def get_key(self, hint, root, info, args):
+        if info.operation.operation != 'query' or not hint.max_age:
+            return None
+        identity = self.identity(root, info)
+        if identity is None:
+            return None
+        if hint.scope == PRIVATE:
+            if self.user_key is None:
+                return None
+            identity = (identity, self.user_key)
+        return json.dumps([info.parent_type.name, info.field_name, identity, args],
+                          sort_keys=True, default=repr)
+
+    def resolve(self, next, root, info, **args):
+        hint = self.get_hint(info)
+        self.update_policy(hint, info)
+        key = hint and self.get_key(hint, root, info, args)
+        if key is None:
+            return next(root, info, **args)
+
+        cached = self.store.get(key)
+        if self.metrics is not None:
+            self.metrics.observe_cache(cached is not None)
+        if cached is not None:
+            return cached[0]
+
+        def remember(value):
+            self.store.set(key, (value,), hint.max_age)
+            return value
+
+        result = next(root, info, **args)
+        if Promise.is_thenable(result):
+            return Promise.resolve(result).then(remember)
+        return remember(result)
@@ -0,0 +1,22 @@
+class HTTPException(Exception):
+    code = None
+    description = None
+
+    def __init__(self, description=None):
+        if description is not None:
+            self.description = description
+        super(HTTPException, self).__init__(self.description)
+
+
+class BadRequest(HTTPException):
+    code = 400
+    description = 'The browser (or proxy) sent a request that this server could not understand.'
+
+
+class MethodNotAllowed(HTTPException):
+    code = 405
+    description = 'The method is not allowed for the requested URL.'
+
+    def __init__(self, valid_methods=None, description=None):
+        super(MethodNotAllowed, self).__init__(description)
+        self.valid_methods = valid_methods
@@ -5,28 +5,30 @@ import re
 import os
 import urlparse
 
-
-from werkzeug.exceptions import BadRequest, MethodNotAllowed
-from urllib import unquote
+from caching import PRIVATE, ResolverCacheMiddleware
+from errors import BadRequest, MethodNotAllowed
 from utils import props
 from init_subclass_meta import InitSubclassMeta
+from rawjson import RawJSONEncoder, RawJSONValidationMiddleware
+from tracing import RequestTrace, get_error_type, log_slow_query, sampled_profile
 
 from graphql import Source, execute, parse, validate
 from graphql.error import format_error as format_graphql_error
 from graphql.error import GraphQLError
 from graphql.execution import ExecutionResult
+from graphql.execution.middleware import MiddlewareManager
 from graphql.type.schema import GraphQLSchema
 from graphql.utils.get_operation_ast import get_operation_ast
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 DIR_PATH = os.path.join(BASE_DIR, 'templates')
+ACCEPT_QUALITY_RE = re.compile(r'(^|;)q=(0(\.\d{,3})?|1(\.0{,3})?)(;|$)')
 
 def get_accepted_content_types():
      def qualify(x):
          parts = x.split(';', 1)
          if len(parts) == 2:
-             match = re.match(r'(^|;)q=(0(\.\d{,3})?|1(\.0{,3})?)(;|$)',
-                              parts[1])
+             match = ACCEPT_QUALITY_RE.match(parts[1])
              if match:
                  return parts[0], float(match.group(2))
          return parts[0], 1
@@ -56,6 +58,17 @@ class GraphQLView:
     batch = False
     graphiql_version = '0.11.11'
     graphiql_temp_title = "GraphQL"
+    slow_query_threshold = None
+    slow_query_logger = None
+    slow_query_redact = ('password', 'secret', 'token')
+    profile_sample_rate = None
+    profile_dir = None
+    metrics = None
+    validate_raw_json = False
+    cache_store = None
+    cache_hints = None
+    single_flight = None
+    _graphiql_render = None
 
     def __init__(self, *args, **kwargs):
         if hasattr(self, 'GraphQLMeta'):
@@ -65,6 +78,18 @@ class GraphQLView:
         assert not all((self.graphiql, self.batch)), 'Use either graphiql or batch processing'
         assert isinstance(self.schema, GraphQLSchema), 'A Schema is required to be provided to GraphQLView.'
 
+        self.trace = RequestTrace()
+        self.cache_middleware = None
+        self.cache_control = None
+        self.documents = {}
+        if self.cache_store is not None:
+            self.cache_middleware = ResolverCacheMiddleware(
+                self.cache_store,
+                hints=self.cache_hints,
+                user_key=self.get_cache_user_key(),
+                metrics=self.metrics,
+            )
+
     def get_root_value(self):
         return self.root_value
 
@@ -74,7 +99,24 @@ class GraphQLView:
         return web.ctx
 
     def get_middleware(self):
-        return self.middleware
+        internal = []
+        if self.validate_raw_json:
+            internal.append(RawJSONValidationMiddleware())
+        if self.cache_middleware is not None:
+            internal.append(self.cache_middleware)
+        if not internal:
+            return self.middleware
+        middleware = self.middleware or []
+        if isinstance(middleware, MiddlewareManager):
+            middleware = middleware.middlewares
+        # First in the chain runs closest to the resolver, after any user middleware.
+        return internal + list(middleware)
+
+    def get_cache_user_key(self):
+        return None
+
+    def get_single_flight_scope(self):
+        return self.get_cache_user_key()
 
     def get_executor(self):
         return self.executor
@@ -83,15 +125,35 @@ class GraphQLView:
         for key, value in kwargs.iteritems():
             kwargs[key] = json.dumps(kwargs.get(key, None))
 
-        render = web.template.render(DIR_PATH)
-        return render.graph(self.graphiql_version, **kwargs)
+        if GraphQLView._graphiql_render is None:
+            GraphQLView._graphiql_render = web.template.render(DIR_PATH)
+        return GraphQLView._graphiql_render.graph(self.graphiql_version, **kwargs)
 
     def dispatch(self):
+        try:
+            with sampled_profile(self.profile_sample_rate, self.profile_dir):
+                result = self.dispatch_request()
+            if isinstance(result, six.string_types):
+                self.trace.result_size = len(result)
+            self.trace.http_status = int(web.ctx.get('status', '200').split(None, 1)[0])
+            return result
+        except Exception as e:
+            self.trace.status_code = self.trace.http_status = 500
+            self.trace.add_error(e)
+            raise
+        finally:
+            log_slow_query(self.trace, self.slow_query_threshold,
+                           self.slow_query_redact, self.slow_query_logger)
+            if self.metrics is not None:
+                self.metrics.observe_request(self.trace, self.batch)
+
+    def dispatch_request(self):
         try:
             if web.ctx.method.lower() not in ('get', 'post'):
                 raise HttpError(MethodNotAllowed(['GET', 'POST'], 'GraphQL only supports GET and POST requests.'))
 
-            data = self.parse_body()
+            with self.trace.phase('parse_body'):
+                data = self.parse_body()
 
             show_graphiql = self.graphiql and self.can_display_graphiql(data)
 
@@ -101,27 +163,79 @@ class GraphQLView:
                 status_code = max(responses, key=lambda response: response[1])[1]
             else:
                 result, status_code = self.get_response(data, show_graphiql)
+            self.trace.status_code = status_code
 
             if show_graphiql:
                 query, variables, operation_name, id = self.get_graphql_params(data)
-                return self.render_graphiql(
-                    query=query,
-                    variables=json.dumps(variables),
-                    operation_name=operation_name,
-                    result=result,
-                    graphiql_temp_title=self.graphiql_temp_title
-                )
+                with self.trace.phase('render'):
+                    return self.render_graphiql(
+                        query=query,
+                        variables=json.dumps(variables),
+                        operation_name=operation_name,
+                        result=result,
+                        graphiql_temp_title=self.graphiql_temp_title
+                    )
             else:
                 web.header('Content-Type', 'application/json')
+                cache_control = self.get_cache_control()
+                if cache_control:
+                    web.header('Cache-Control', cache_control)
                 return result
 
         except HttpError as e:
+            self.trace.status_code = e.response.code
+            self.trace.add_error(e.response)
             web.header('Content-Type', 'application/json')
             return self.json_encode({'errors': [self.format_error(e)]})
 
+    def get_cache_control(self):
+        if self.cache_control is not None:
+            return self.cache_control
+        if self.cache_middleware is None or self.trace.error_type is not None:
+            return None
+        return self.cache_middleware.get_cache_control()
+
+    def get_single_flight_key(self, query, variables, operation_name):
+        if self.single_flight is None or self.batch or not query:
+            return None
+        try:
+            operation_ast = get_operation_ast(self.parse_document(query), operation_name)
+        except Exception:
+            return None
+        if not operation_ast or operation_ast.operation != 'query':
+            return None
+        # Without a scope key, resolvers reading the context could leak one user's response to another.
+        scope = self.get_single_flight_scope()
+        if scope is None:
+            return None
+        return json.dumps([query, variables, operation_name, scope,
+                           bool(web.input().get('pretty'))], sort_keys=True, default=repr)
+
     def get_response(self, data, show_graphiql=False):
         query, variables, operation_name, id = self.get_graphql_params(data)
+        self.trace.add_operation(query, variables, operation_name)
+
+        key = None if show_graphiql else self.get_single_flight_key(query, variables, operation_name)
+        if key is None:
+            return self.build_response(data, query, variables, operation_name, id, show_graphiql)
+
+        leader = []
+
+        def run():
+            leader.append(True)
+            result, status_code = self.build_response(data, query, variables, operation_name, id)
+            private = self.cache_middleware is not None and self.cache_middleware.scope == PRIVATE
+            return result, status_code, self.trace.error_type, self.get_cache_control(), private
+
+        result, status_code, error_type, cache_control, private = self.single_flight.do(key, run)
+        if private and not leader:
+            return self.build_response(data, query, variables, operation_name, id)
+        self.trace.error_type = error_type
+        self.trace.set_operation_result(status_code, error_type)
+        self.cache_control = cache_control
+        return result, status_code
 
+    def build_response(self, data, query, variables, operation_name, id, show_graphiql=False):
         execution_result = self.execute_graphql_request(
             data,
             query,
@@ -131,11 +245,14 @@ class GraphQLView:
         )
 
         status_code = 200
+        error_type = None
         if execution_result:
             response = {}
 
             if execution_result.errors:
                 response['errors'] = [self.format_error(e) for e in execution_result.errors]
+                self.trace.add_error(execution_result.errors[0])
+                error_type = get_error_type(execution_result.errors[0])
 
             if execution_result.invalid:
                 status_code = 400
@@ -150,10 +267,12 @@ class GraphQLView:
                     'status': status_code,
                 }
 
-            result = self.json_encode(response, show_graphiql)
+            with self.trace.phase('encode'):
+                result = self.json_encode(response, show_graphiql)
         else:
             result = None
 
+        self.trace.set_operation_result(status_code, error_type)
         return result, status_code
 
     def execute(self, *args, **kwargs):
@@ -166,9 +285,10 @@ class GraphQLView:
             raise HttpError(BadRequest('Must provide query string.'))
 
         try:
-            source = Source(query, name='GraphQL request')
-            ast = parse(source)
-            validation_errors = validate(self.schema, ast)
+            with self.trace.phase('parse'):
+                ast = self.parse_document(query)
+            with self.trace.phase('validate'):
+                validation_errors = validate(self.schema, ast)
             if validation_errors:
                 return ExecutionResult(
                     errors=validation_errors,
@@ -187,18 +307,24 @@ class GraphQLView:
                 ))
 
         try:
-            return self.execute(
-                ast,
-                root_value=self.get_root_value(),
-                variable_values=variables or {},
-                operation_name=operation_name,
-                context_value=self.get_context(),
-                middleware=self.get_middleware(),
-                executor=self.get_executor()
-            )
+            with self.trace.phase('execute'):
+                return self.execute(
+                    ast,
+                    root_value=self.get_root_value(),
+                    variable_values=variables or {},
+                    operation_name=operation_name,
+                    context_value=self.get_context(),
+                    middleware=self.get_middleware(),
+                    executor=self.get_executor()
+                )
         except Exception as e:
             return ExecutionResult(errors=[e], invalid=True)
 
+    def parse_document(self, query):
+        if query not in self.documents:
+            self.documents[query] = parse(Source(query, name='GraphQL request'))
+        return self.documents[query]
+
     def parse_body(self):
         content_type = web.ctx.env.get('CONTENT_TYPE')
         if content_type == 'application/graphql':
@@ -226,10 +352,9 @@ class GraphQLView:
     def json_encode(self, d, show_graphiql=False):
         pretty = self.pretty or show_graphiql or web.input().get('pretty')
         if not pretty:
-            return json.dumps(d, separators=(',', ':'))
+            return RawJSONEncoder(separators=(',', ':')).encode(d)
 
-        return json.dumps(d, sort_keys=True,
-                          indent=2, separators=(',', ': '))
+        return RawJSONEncoder(sort_keys=True, indent=2, separators=(',', ': ')).encode(d)
 
     def get_graphql_params(self, data):
         variables = query = id = operation_name = None
@@ -0,0 +1,261 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import six
+import web
+
+
+logger = logging.getLogger('webpy_graphql.metrics')
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+
+
+def _escape(value):
+    return six.text_type(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, registry, name, documentation, label_names=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(six.text_type(labels.get(name, '')) for name in self.label_names)
+
+    def snapshot(self):
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labels': self.label_names,
+            'values': [[list(key), value] for key, value in self.values.items()],
+        }
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.touch()
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(registry, name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.touch()
+            # Per-bucket counts followed by sum and count; made cumulative on render.
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        snapshot = super(Histogram, self).snapshot()
+        snapshot['buckets'] = self.buckets[:-1]
+        return snapshot
+
+
+class Registry(object):
+    def __init__(self, multiprocess_dir=None, flush_interval=1.0):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self.dirty = False
+        self.closed = False
+        self.pid = None
+        self.path = None
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(self, name, *args, **kwargs)
+            metric = self.metrics[name]
+        assert isinstance(metric, cls), 'Metric {} is already registered as a {}.'.format(name, metric.type)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def snapshot(self):
+        with self.lock:
+            return dict((name, metric.snapshot()) for name, metric in self.metrics.items())
+
+    def touch(self):
+        # Called with the lock held on every update.
+        self.dirty = True
+        if self.multiprocess_dir and self.pid != os.getpid():
+            self._start_process()
+
+    def _start_process(self):
+        # Values inherited across a fork were already written by the parent, so a child starts from zero.
+        if self.pid is not None:
+            for metric in self.metrics.values():
+                metric.values.clear()
+        self.pid = os.getpid()
+        # The start time keeps a recycled PID from overwriting a dead worker's totals.
+        self.path = os.path.join(self.multiprocess_dir, 'metrics-{}-{:.6f}.json'.format(self.pid, time.time()))
+        flusher = threading.Thread(target=self._flush_periodically)
+        flusher.daemon = True
+        flusher.start()
+        atexit.register(self.close)
+
+    def _flush_periodically(self):
+        pid, sleep = self.pid, time.sleep
+        while self.pid == pid and not self.closed:
+            sleep(self.flush_interval)
+            if self.dirty and not self.closed:
+                self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except (IOError, OSError):
+            logger.exception('Could not write GraphQL metrics to %s', self.multiprocess_dir)
+
+    def close(self):
+        self.closed = True
+        if self.dirty:
+            self._safe_flush()
+
+    def flush(self):
+        if not self.multiprocess_dir or self.pid != os.getpid():
+            return
+        with self.lock:
+            self.dirty = False
+            snapshot = dict((name, metric.snapshot()) for name, metric in self.metrics.items())
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp_path, self.path)
+
+    def collect(self):
+        if not self.multiprocess_dir:
+            return self.snapshot()
+
+        self.flush()
+        merged = {}
+        for path in sorted(glob.glob(os.path.join(self.multiprocess_dir, 'metrics-*.json'))):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError):
+                continue
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, dict(metric, values={}))
+                for key, value in metric['values']:
+                    key = tuple(key)
+                    if key not in target['values']:
+                        target['values'][key] = value
+                    elif isinstance(value, list):
+                        target['values'][key] = [a + b for a, b in zip(target['values'][key], value)]
+                    else:
+                        target['values'][key] += value
+        for metric in merged.values():
+            metric['values'] = list(metric['values'].items())
+        return merged
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append('# HELP {} {}'.format(name, metric['help']))
+            lines.append('# TYPE {} {}'.format(name, metric['type']))
+            for key, value in sorted(metric['values'], key=lambda item: tuple(item[0])):
+                if metric['type'] == 'histogram':
+                    cumulative = 0
+                    bounds = list(metric['buckets']) + [float('inf')]
+                    for bound, count in zip(bounds, value):
+                        cumulative += count
+                        lines.append('{}_bucket{} {}'.format(
+                            name, _format_labels(metric['labels'], key, [('le', _format_value(bound))]), cumulative))
+                    labels = _format_labels(metric['labels'], key)
+                    lines.append('{}_sum{} {}'.format(name, labels, _format_value(value[-2])))
+                    lines.append('{}_count{} {}'.format(name, labels, value[-1]))
+                else:
+                    lines.append('{}{} {}'.format(name, _format_labels(metric['labels'], key), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class GraphQLMetrics(object):
+    def __init__(self, registry=None):
+        self.registry = registry = registry or REGISTRY
+        self.requests = registry.counter(
+            'graphql_requests_total', 'GraphQL operations by operation name, HTTP status and error type.',
+            ('operation', 'status', 'error_type'))
+        self.latency = registry.histogram(
+            'graphql_request_duration_seconds', 'GraphQL HTTP request latency.')
+        self.batch_size = registry.histogram(
+            'graphql_batch_size', 'Number of operations per batched request.', buckets=BATCH_BUCKETS)
+        self.response_bytes = registry.histogram(
+            'graphql_response_bytes', 'Size of GraphQL responses in bytes.', buckets=SIZE_BUCKETS)
+        self.cache = registry.counter(
+            'graphql_cache_requests_total', 'GraphQL cache lookups by result.', ('result',))
+
+    def observe_request(self, trace, batch=False):
+        if not trace.operations:
+            self.requests.inc(operation='anonymous', status=trace.http_status,
+                              error_type=trace.error_type or 'none')
+        for operation in trace.operations:
+            self.requests.inc(operation=operation['operation_name'] or 'anonymous',
+                              status=trace.http_status,
+                              error_type=trace.operation_error_type(operation) or 'none')
+        self.latency.observe(trace.elapsed())
+        self.response_bytes.observe(trace.result_size)
+        if batch:
+            self.batch_size.observe(len(trace.operations))
+
+    def observe_cache(self, hit):
+        self.cache.inc(result='hit' if hit else 'miss')
+
+
+class MetricsView:
+    registry = REGISTRY
+
+    def GET(self):
+        web.header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        return self.registry.render()
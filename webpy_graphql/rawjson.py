@@ -0,0 +1,100 @@
+import binascii
+import json
+import os
+import re
+import six
+
+from graphql.type.definition import GraphQLScalarType, get_named_type
+from promise import Promise
+
+
+class RawJSON(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'RawJSON({!r})'.format(self.value)
+
+
+def _coerce_fragment(fragment, text):
+    # Splicing UTF-8 bytes into unicode (or the reverse) raises UnicodeDecodeError on Python 2.
+    if text and isinstance(fragment, bytes):
+        return fragment.decode('utf8')
+    if not text and isinstance(fragment, six.text_type):
+        return fragment.encode('utf8')
+    return fragment
+
+
+class RawJSONEncoder(json.JSONEncoder):
+    def __init__(self, **kwargs):
+        super(RawJSONEncoder, self).__init__(**kwargs)
+        self.fragments = []
+        self.token = '__raw_json_{}_'.format(binascii.hexlify(os.urandom(16)).decode('ascii'))
+
+    def default(self, o):
+        if isinstance(o, RawJSON):
+            self.fragments.append(o.value)
+            return '{}{}'.format(self.token, len(self.fragments) - 1)
+        return super(RawJSONEncoder, self).default(o)
+
+    def encode(self, o):
+        self.fragments = []
+        result = super(RawJSONEncoder, self).encode(o)
+        if not self.fragments:
+            return result
+
+        text = isinstance(result, six.text_type)
+        fragments = [_coerce_fragment(fragment, text) for fragment in self.fragments]
+        return re.sub('"{}(\\d+)"'.format(self.token),
+                      lambda match: fragments[int(match.group(1))],
+                      result)
+
+
+def serialize_raw_json(value):
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, (bytes, six.text_type)):
+        return RawJSON(value)
+    return value
+
+
+GraphQLRawJSON = GraphQLScalarType(
+    name='RawJSON',
+    description='A JSON value passed through to the response without re-encoding.',
+    serialize=serialize_raw_json,
+    parse_value=lambda value: value,
+    parse_literal=lambda ast: None,
+)
+
+
+def validate_raw_json(value):
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            validate_raw_json(item)
+        return value
+    fragment = value.value if isinstance(value, RawJSON) else value
+    if isinstance(fragment, (bytes, six.text_type)):
+        try:
+            json.loads(fragment)
+        except ValueError as e:
+            raise ValueError('Invalid raw JSON fragment: {}'.format(e))
+    return value
+
+
+class RawJSONValidationMiddleware(object):
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if get_named_type(info.return_type) is not GraphQLRawJSON:
+            return result
+        # Failing here rather than in the encoder turns a bad fragment into a located field error.
+        if Promise.is_thenable(result):
+            return Promise.resolve(result).then(validate_raw_json)
+        return validate_raw_json(result)
@@ -0,0 +1,79 @@
+import threading
+
+
+class _Flight(object):
+    def __init__(self):
+        # Held by the leader until the result is ready. A blocking acquire wakes waiters
+        # immediately, unlike Event.wait(timeout), which polls on Python 2.
+        self.done = threading.Lock()
+        self.done.acquire()
+        self.waiters = 0
+        self.result = None
+        self.failed = False
+        self.finished = False
+        self.expired = False
+        self.timer = None
+
+
+class SingleFlight(object):
+    def __init__(self, max_waiters=1000, timeout=10):
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        leader = False
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                leader = True
+            elif flight.waiters >= self.max_waiters:
+                flight = None
+            else:
+                flight.waiters += 1
+                if flight.timer is None:
+                    flight.timer = threading.Timer(self.timeout, self._expire, (key, flight))
+                    flight.timer.daemon = True
+                    flight.timer.start()
+
+        if flight is None:
+            return fn()
+
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException:
+                flight.failed = True
+                raise
+            finally:
+                self._finish(key, flight)
+            return flight.result
+
+        flight.done.acquire()
+        # Pass the lock on so every other waiter wakes up too.
+        flight.done.release()
+        # Waiters that time out or whose leader failed execute on their own.
+        if flight.expired or flight.failed:
+            return fn()
+        return flight.result
+
+    def _finish(self, key, flight):
+        with self.lock:
+            flight.finished = True
+            if flight.expired:
+                return
+            del self.flights[key]
+        if flight.timer is not None:
+            flight.timer.cancel()
+        flight.done.release()
+
+    def _expire(self, key, flight):
+        # Releases the waiters of a leader that is taking too long; later callers start a new flight.
+        with self.lock:
+            if flight.finished:
+                return
+            flight.expired = True
+            del self.flights[key]
+        flight.done.release()
@@ -0,0 +1,140 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('webpy_graphql.slow_query')
+profile_logger = logging.getLogger('webpy_graphql.profile')
+
+REDACTED = '[REDACTED]'
+
+_request_counter = itertools.count(1)
+
+
+def query_hash(query):
+    if not query:
+        return None
+    if not isinstance(query, bytes):
+        query = query.encode('utf8')
+    return hashlib.sha256(query).hexdigest()
+
+
+def sanitize_variables(variables, redact):
+    if isinstance(variables, dict):
+        return dict(
+            (key, REDACTED if any(word in key.lower() for word in redact)
+             else sanitize_variables(value, redact))
+            for key, value in variables.items()
+        )
+    if isinstance(variables, (list, tuple)):
+        return [sanitize_variables(value, redact) for value in variables]
+    return variables
+
+
+def should_sample(rate):
+    return bool(rate) and next(_request_counter) % rate == 0
+
+
+def get_error_type(error):
+    error = getattr(error, 'original_error', None) or error
+    return type(error).__name__
+
+
+class RequestTrace(object):
+    def __init__(self):
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.operations = []
+        self.status_code = 200
+        self.http_status = 200
+        self.error_type = None
+        self.result_size = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.time() - start
+
+    def add_operation(self, query, variables, operation_name):
+        self.operations.append({
+            'query': query,
+            'variables': variables,
+            'operation_name': operation_name,
+            'status_code': None,
+            'error_type': None,
+        })
+
+    def set_operation_result(self, status_code, error_type=None):
+        self.operations[-1].update(status_code=status_code, error_type=error_type)
+
+    def operation_error_type(self, operation):
+        # Operations that never produced a result failed along with the whole request.
+        if operation['status_code'] is None:
+            return self.error_type
+        return operation['error_type']
+
+    def add_error(self, error):
+        if self.error_type is None:
+            self.error_type = get_error_type(error)
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def as_log_entry(self, redact):
+        return {
+            'duration_ms': round(self.elapsed() * 1000, 3),
+            'phases_ms': OrderedDict(
+                (name, round(value * 1000, 3)) for name, value in self.phases.items()
+            ),
+            'status': self.http_status,
+            'graphql_status': self.status_code,
+            'error_type': self.error_type,
+            'result_size': self.result_size,
+            'operations': [{
+                'operation_name': operation['operation_name'],
+                'query_hash': query_hash(operation['query']),
+                'variables': sanitize_variables(operation['variables'], redact),
+                'status': operation['status_code'],
+                'error_type': self.operation_error_type(operation),
+            } for operation in self.operations],
+        }
+
+
+def log_slow_query(trace, threshold, redact, log=None):
+    if threshold is None or trace.elapsed() < threshold:
+        return
+    (log or logger).warning('Slow GraphQL request: %s',
+                            json.dumps(trace.as_log_entry(redact), default=repr))
+
+
+@contextmanager
+def sampled_profile(rate, directory):
+    if not directory or not should_sample(rate):
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        filename = 'graphql-{:.6f}-{}.prof'.format(time.time(), os.getpid())
+        # Profiling is a side channel: failing to write it must never fail the request.
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            profiler.dump_stats(os.path.join(directory, filename))
+        except (IOError, OSError):
+            profile_logger.exception('Could not write GraphQL profile to %s', directory)